@@ -1,7 +1,7 @@
 import os
 import re
-from datetime import datetime
 from zoneinfo import ZoneInfo
+from aiohttp.web import Application
 from dotenv import load_dotenv
 
 from microsoft_agents.hosting.core import (
@@ -16,10 +16,20 @@ from microsoft_agents.hosting.aiohttp import CloudAdapter
 
 from .start_server import start_server
 from .reminders import save_reminder, setup_scheduler
-from .llm import ask_with_llm
+from .llm import ask_with_llm, close_llm, llm_configured
 
 load_dotenv()
 
+# Resolved once at startup, so a bad LOCAL_TZ fails fast instead of on every /remind.
+_LOCAL_TZ_NAME = os.getenv("LOCAL_TZ", "UTC")
+_LOCAL_TZ = ZoneInfo(_LOCAL_TZ_NAME)
+
+_REMIND_PREFIX = "/remind"
+_REMIND_RE = re.compile(r"^/remind\s+(\d+)\s+(.+)$", re.IGNORECASE)
+_ECHO_PREFIX = "echo "
+# Minimum buffered answer length before a streamed /ask reply is flushed mid-paragraph.
+_STREAM_FLUSH_CHARS = 300
+
 #AUTH_CONFIG = AgentAuthConfiguration(token_provider=AnonymousTokenProvider())
 AUTH_CONFIG = AgentAuthConfiguration(
     app_id=os.getenv("MICROSOFT_APP_ID", "local-bot-id"),
@@ -39,6 +49,35 @@ AGENT_APP = AgentApplication[TurnState](
 )
 
 
+def _last_cut(buf: str, sep: str, offset: int) -> int:
+    """Position of the last `sep` (+offset) that is a safe place to split, or 0."""
+    i = buf.rfind(sep)
+    while i > 0:
+        # Not inside a ``` code fence, and not the "3." of a numbered-list item.
+        if buf.count("```", 0, i) % 2 == 0 and not (
+            sep == ". " and buf[buf.rfind("\n", 0, i) + 1:i].strip().isdigit()
+        ):
+            return i + offset
+        i = buf.rfind(sep, 0, i)
+    return 0
+
+
+def _stream_cut(buf: str) -> int:
+    """
+    Return how much of a streamed LLM answer is ready to be posted (0 = keep buffering):
+    up to the last paragraph break or, once the buffer is long enough, the last line
+    break or sentence end. Never cuts inside a fenced code block or a list marker, so
+    each posted piece renders on its own.
+    """
+    cut = _last_cut(buf, "\n\n", 0)
+    if not cut and len(buf) >= _STREAM_FLUSH_CHARS:
+        cut = max(
+            _last_cut(buf, "\n", 0),
+            *(_last_cut(buf, sep, 1) for sep in (". ", "! ", "? ")),
+        )
+    return cut
+
+
 async def _help(context: TurnContext, _):
     await context.send_activity(
         """
@@ -46,7 +85,7 @@ Hi! I'm your Teams agent.
 
 **Commands**
 - `echo <text>` — I’ll repeat `<text>`
-- `/ask <question>` — (optional) Ask an LLM if OPENAI_API_KEY is set
+- `/ask <question>` — (optional) Ask an LLM if VLLM_BASE_URL is set
 - `/remind <N> <message>` — I’ll remind you in N minutes
 
 Example: `/remind 5 stand up`
@@ -68,46 +107,66 @@ async def on_message(context: TurnContext, _):
     # /ask (LLM)
     if text.startswith("/ask"):
         prompt = text[len("/ask"):].strip() or "Say hello"
+        if not llm_configured():
+            await context.send_activity(
+                "LLM not configured. Set VLLM_BASE_URL (and VLLM_API_KEY) in your .env "
+                "to enable /ask."
+            )
+            return
         try:
-            ans = ask_with_llm(prompt)
-            if ans is None:
-                await context.send_activity(
-                    "LLM not configured. Set OPENAI_API_KEY in your .env to enable /ask."
-                )
-            else:
-                await context.send_activity(ans)
+            # Stream the answer and post it in pieces so the user sees progress early.
+            buf = ""
+            sent_any = False
+            async for delta in ask_with_llm(prompt):
+                buf += delta
+                cut = _stream_cut(buf)
+                if cut:
+                    await context.send_activity(buf[:cut])
+                    buf = buf[cut:].lstrip()
+                    sent_any = True
+            if buf.strip():
+                await context.send_activity(buf)
+            elif not sent_any:
+                await context.send_activity("The LLM returned an empty answer.")
         except Exception as e:  # pragma: no cover
             await context.send_activity(f"LLM error: {e}")
         return
 
     # Remind: /remind <N> <message>
-    m = re.match(r"^/remind\s+(\d+)\s+(.+)$", text, re.IGNORECASE)
+    # Cheap prefix check first so ordinary messages never reach the regex engine.
+    m = _REMIND_RE.match(text) if text[:len(_REMIND_PREFIX)].lower() == _REMIND_PREFIX else None
     if m:
         minutes = int(m.group(1))
         message = m.group(2).strip()
-        rid, due_at = save_reminder(minutes, message, context)
+        rid, due_at = await save_reminder(minutes, message, context)
         # Show user local time if configured
-        tz = os.getenv("LOCAL_TZ", "UTC")
-        try:
-            local_due = datetime.fromisoformat(due_at.isoformat()).astimezone(ZoneInfo(tz))
-            when = local_due.strftime("%H:%M")
-            await context.send_activity(f"Got it. I’ll remind you at ~{when} ({tz}). [id={rid}]")
-        except Exception:
-            await context.send_activity(f"Got it. I’ll remind you in {minutes} minute(s). [id={rid}]")
+        when = due_at.astimezone(_LOCAL_TZ).strftime("%H:%M")
+        await context.send_activity(
+            f"Got it. I’ll remind you at ~{when} ({_LOCAL_TZ_NAME}). [id={rid}]"
+        )
         return
 
     # Echo
-    if text.lower().startswith("echo "):
-        await context.send_activity(text[5:])
+    if text[:len(_ECHO_PREFIX)].lower() == _ECHO_PREFIX:
+        await context.send_activity(text[len(_ECHO_PREFIX):])
         return
 
     # Default
     await context.send_activity("Try `echo ...`, `/ask ...`, or `/remind N ...` (or `/help`).")
 
 
+def _on_startup(app: Application, agent_app: AgentApplication) -> None:
+    setup_scheduler(app, agent_app)
+
+    async def _close_llm(_):
+        await close_llm()
+
+    app.on_cleanup.append(_close_llm)
+
+
 if __name__ == "__main__":
     try:
-        start_server(AGENT_APP, None, on_startup=setup_scheduler)
+        start_server(AGENT_APP, on_startup=_on_startup)
         #start_server(AGENT_APP, AUTH_CONFIG, on_startup=setup_scheduler)
     except Exception as error:
         raise error
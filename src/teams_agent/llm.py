@@ -1,22 +1,68 @@
+import functools
 import os
-from typing import Optional
-from openai import OpenAI
+from typing import AsyncIterator, Optional
+import httpx
+from openai import AsyncOpenAI
 
-BASE_URL = ""
-API_KEY = ""
-MODEL = "Mistral-Small-3.2-24B-Instruct-2506"
+DEFAULT_MODEL = "Mistral-Small-3.2-24B-Instruct-2506"
 
-client = OpenAI(base_url=BASE_URL, api_key=API_KEY)
 
-def ask_with_llm(prompt: str) -> Optional[str]:
+@functools.cache
+def _client() -> Optional[AsyncOpenAI]:
+    """
+    Build the client on first use so importing this module does no network/SSL setup.
+    Returns None when no server is configured.
+    """
+    base_url = os.getenv("VLLM_BASE_URL")
+    if not base_url:
+        return None
+    # One keep-alive pool shared by every /ask; fail fast on connect, allow slow generations.
+    # httpx only negotiates HTTP/2 over TLS, so with the usual plain http:// vLLM URL this
+    # stays on HTTP/1.1 keep-alive; http2=True only takes effect for an https:// endpoint.
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        timeout=httpx.Timeout(60.0, connect=2.0),
+    )
+    return AsyncOpenAI(
+        base_url=base_url,
+        # vLLM accepts any key unless started with --api-key; the SDK needs a non-empty value.
+        api_key=os.getenv("VLLM_API_KEY") or "EMPTY",
+        http_client=http_client,
+    )
+
+
+async def close_llm() -> None:
+    """Close the client's HTTP pool, if one was ever created."""
+    if _client.cache_info().currsize:
+        client = _client()
+        _client.cache_clear()
+        if client is not None:
+            await client.close()
+
+
+def llm_configured() -> bool:
+    """Cheap config check; building the client is left to ask_with_llm()."""
+    return bool(os.getenv("VLLM_BASE_URL"))
+
+
+async def ask_with_llm(prompt: str) -> AsyncIterator[str]:
     """
     Send a simple single-turn prompt to the local vLLM server
-    using the OpenAI-compatible Chat Completions API.
+    using the OpenAI-compatible Chat Completions API, yielding
+    the answer as it is generated. Yields nothing if the server
+    is not configured.
     """
-    resp = client.chat.completions.create(
-        model=MODEL,
+    client = _client()
+    if client is None:
+        return
+    stream = await client.chat.completions.create(
+        model=os.getenv("VLLM_MODEL", DEFAULT_MODEL),
         messages=[{"role": "user", "content": prompt}],
         temperature=float(os.getenv("VLLM_TEMPERATURE", "0.7")),
         max_tokens=int(os.getenv("VLLM_MAX_TOKENS", "512")),
+        stream=True,
     )
-    return resp.choices[0].message.content if resp.choices else None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
@@ -1,12 +1,18 @@
 import os
-import json
-import sqlite3
+import asyncio
+import bisect
+import contextlib
+import inspect
+import time
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
+import aiosqlite
+import orjson
 from aiohttp.web import Application
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from microsoft_agents.hosting.core import AgentApplication, TurnContext
 from microsoft_agents.hosting.aiohttp import CloudAdapter
@@ -18,6 +24,9 @@ from botbuilder.schema import ConversationReference
 # ---- Configuration ----
 DB_PATH = os.getenv("REMINDERS_DB", "reminders.db")
 APP_ID = os.getenv("MICROSOFT_APP_ID", "")  # In local playground this can be empty.
+SENT_RETENTION = timedelta(days=7)  # Delivered reminders are pruned after this long.
+CHECKPOINT_INTERVAL_S = 5 * 60
+PRUNE_INTERVAL_S = 24 * 60 * 60
 
 
 # ---- Data model ----
@@ -31,51 +40,182 @@ class Reminder:
 
 
 # ---- SQLite helpers ----
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def init_db() -> None:
-    with _connect() as con:
-        con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS reminders (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              due_at_utc TEXT NOT NULL,
-              text TEXT NOT NULL,
-              conversation_ref TEXT NOT NULL,
-              sent INTEGER NOT NULL DEFAULT 0
-            )
-            """
+# One shared async connection (autocommit mode); opened by init_db() on app startup.
+_DB: Optional[aiosqlite.Connection] = None
+# Serializes writes (and anything that must not run inside a write transaction, such as
+# a WAL checkpoint). Unlocked reads on this same connection run inside whatever write
+# transaction is open and see its uncommitted rows; WAL gives them no isolation here.
+_WRITE_LOCK = asyncio.Lock()
+
+
+def _db() -> aiosqlite.Connection:
+    if _DB is None:
+        raise RuntimeError("Reminders database is not open; call init_db() first")
+    return _DB
+
+
+# due_at_utc is stored as integer unix epoch seconds.
+_CREATE_REMINDERS_SQL = """
+    CREATE TABLE IF NOT EXISTS reminders (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      due_at_utc INTEGER NOT NULL,
+      text TEXT NOT NULL,
+      conversation_ref TEXT NOT NULL,
+      sent INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+
+@contextlib.asynccontextmanager
+async def _transaction(db: aiosqlite.Connection) -> AsyncIterator[None]:
+    """
+    Wrap the block in BEGIN IMMEDIATE/COMMIT, rolling back on any exception including
+    cancellation. aiosqlite still runs a statement whose awaiter was cancelled, so a
+    missed ROLLBACK would leave the shared connection stuck inside a transaction.
+    """
+    try:
+        await db.execute("BEGIN IMMEDIATE")
+        yield
+        await db.execute("COMMIT")
+    except BaseException:
+        # Fails harmlessly if BEGIN never ran or COMMIT already went through.
+        with contextlib.suppress(aiosqlite.OperationalError):
+            await db.execute("ROLLBACK")
+        raise
+
+
+async def _migrate_due_at_to_epoch(db: aiosqlite.Connection) -> None:
+    """Rebuild a pre-existing table whose due_at_utc column still holds ISO-8601 text."""
+    async with db.execute("PRAGMA table_info(reminders)") as cur:
+        columns = {row["name"]: row["type"] for row in await cur.fetchall()}
+    if columns.get("due_at_utc", "").upper() != "TEXT":
+        return
+    async with _transaction(db):
+        async with db.execute(
+            "SELECT id, due_at_utc, text, conversation_ref, sent FROM reminders"
+        ) as cur:
+            rows = await cur.fetchall()
+        await db.execute("DROP INDEX IF EXISTS idx_reminders_pending")
+        await db.execute("ALTER TABLE reminders RENAME TO reminders_old")
+        await db.execute(_CREATE_REMINDERS_SQL)
+        await db.executemany(
+            "INSERT INTO reminders (id, due_at_utc, text, conversation_ref, sent) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    r["id"],
+                    int(datetime.fromisoformat(r["due_at_utc"]).timestamp()),
+                    r["text"],
+                    r["conversation_ref"],
+                    r["sent"],
+                )
+                for r in rows
+            ],
         )
-        con.commit()
+        await db.execute("DROP TABLE reminders_old")
+
+
+async def init_db() -> aiosqlite.Connection:
+    """Open the shared connection and make sure the schema is current."""
+    global _DB
+    db = await aiosqlite.connect(DB_PATH, isolation_level=None)
+    db.row_factory = aiosqlite.Row
+    # Only takes effect on a fresh database (before the first table is created).
+    await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    if DB_PATH != ":memory:":
+        await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-64000")
+    await db.execute("PRAGMA busy_timeout=5000")
+    await db.execute(_CREATE_REMINDERS_SQL)
+    await _migrate_due_at_to_epoch(db)
+    # Partial index: only pending rows are indexed, so it stays small as history grows.
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders(due_at_utc) WHERE sent=0"
+    )
+    _DB = db
+    return db
+
 
+async def close_db() -> None:
+    global _DB
+    # Wait for an in-flight (e.g. shielded) write to finish before closing.
+    async with _WRITE_LOCK:
+        if _DB is not None:
+            await _DB.close()
+            _DB = None
 
-def _row_to_reminder(row: sqlite3.Row) -> Reminder:
+
+def _row_to_reminder(row: aiosqlite.Row) -> Reminder:
     return Reminder(
         id=row["id"],
-        due_at_utc=datetime.fromisoformat(row["due_at_utc"]),
+        due_at_utc=datetime.fromtimestamp(row["due_at_utc"], tz=timezone.utc),
         text=row["text"],
-        conversation_ref=json.loads(row["conversation_ref"]),
+        conversation_ref=orjson.loads(row["conversation_ref"]),
         sent=row["sent"],
     )
 
 
-def fetch_due(now: datetime) -> List[Reminder]:
-    with _connect() as con:
-        rows = con.execute(
-            "SELECT * FROM reminders WHERE sent=0 AND due_at_utc <= ? ORDER BY due_at_utc ASC",
-            (now.isoformat(),),
-        ).fetchall()
-    return [_row_to_reminder(r) for r in rows]
+async def fetch_pending_schedule() -> List[Tuple[int, int]]:
+    """Return (due_at_utc, id) for every unsent reminder, earliest first."""
+    async with _db().execute(
+        "SELECT due_at_utc, id FROM reminders WHERE sent=0 ORDER BY due_at_utc ASC"
+    ) as cur:
+        return [(row[0], row[1]) for row in await cur.fetchall()]
+
+
+async def fetch_reminders(ids: List[int]) -> List[Reminder]:
+    """Load full reminders for `ids`, earliest due first."""
+    rows = []
+    # Stay well below SQLite's host-parameter limit.
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        async with _db().execute(
+            "SELECT id, due_at_utc, text, conversation_ref, sent FROM reminders"
+            f" WHERE id IN ({placeholders})",
+            chunk,
+        ) as cur:
+            rows.extend(await cur.fetchall())
+    return sorted((_row_to_reminder(r) for r in rows), key=lambda r: (r.due_at_utc, r.id))
+
+
+async def mark_sent(reminder_id: int) -> None:
+    await mark_sent_bulk([reminder_id])
+
+
+async def mark_sent_bulk(ids: List[int]) -> None:
+    """Mark several reminders as sent in a single transaction (one fsync)."""
+    if not ids:
+        return
+    # Shielded: the messages are already out, so a shutdown cancelling the caller must not
+    # drop the marks and have them delivered again after a restart.
+    await asyncio.shield(_mark_sent_bulk(ids))
+
+
+async def _mark_sent_bulk(ids: List[int]) -> None:
+    db = _db()
+    async with _WRITE_LOCK, _transaction(db):
+        await db.executemany("UPDATE reminders SET sent=1 WHERE id=?", [(i,) for i in ids])
+
 
+async def prune_sent(retention: timedelta = SENT_RETENTION) -> None:
+    """Delete reminders delivered more than `retention` ago and give freed pages back."""
+    cutoff_ts = int((datetime.now(timezone.utc) - retention).timestamp())
+    db = _db()
+    async with _WRITE_LOCK:
+        await db.execute("DELETE FROM reminders WHERE sent=1 AND due_at_utc < ?", (cutoff_ts,))
+        # No-op unless the file was created with auto_vacuum=INCREMENTAL. executescript()
+        # steps the pragma to completion; execute() would free only a single page.
+        await db.executescript("PRAGMA incremental_vacuum(100);")
 
-def mark_sent(reminder_id: int) -> None:
-    with _connect() as con:
-        con.execute("UPDATE reminders SET sent=1 WHERE id=?", (reminder_id,))
-        con.commit()
+
+async def checkpoint_wal() -> None:
+    """Fold the WAL back into the main database file without blocking readers/writers."""
+    if DB_PATH == ":memory:":
+        return
+    async with _WRITE_LOCK:
+        await _db().execute("PRAGMA wal_checkpoint(PASSIVE)")
 
 
 # ---- ConversationReference (de)serialization ----
@@ -114,92 +254,245 @@ def _dict_to_conv_ref(data: Dict[str, Any]) -> ConversationReference:
     return ConversationReference(**data)
 
 
+# Serialized conversation references keyed on (conversation id, service url, user id),
+# LRU-bounded. The user is part of the key because the reference carries the requester's
+# identity, which differs between members of a group chat or channel.
+_CONV_REF_CACHE: "OrderedDict[Tuple[str, str, Optional[str]], str]" = OrderedDict()
+_CONV_REF_CACHE_SIZE = 1024
+
+
+def _conversation_ref_for(activity: Any) -> str:
+    """
+    Return the activity's conversation reference as JSON, reusing the
+    serialized form for repeat reminders in the same conversation.
+    """
+    key = (
+        activity.conversation.id,
+        activity.service_url,
+        getattr(activity.from_property, "id", None),
+    )
+    cached = _CONV_REF_CACHE.get(key)
+    if cached is not None:
+        _CONV_REF_CACHE.move_to_end(key)
+        return cached
+
+    # Extract conversation reference using Bot Framework helper
+    conv_ref_dict = _conv_ref_to_dict(BfTurnContext.get_conversation_reference(activity))
+    # activity_id is per message; a proactive reminder does not reply to a specific one.
+    conv_ref_dict.pop("activity_id", None)
+    cached = orjson.dumps(conv_ref_dict).decode()
+    _CONV_REF_CACHE[key] = cached
+    if len(_CONV_REF_CACHE) > _CONV_REF_CACHE_SIZE:
+        _CONV_REF_CACHE.popitem(last=False)
+    return cached
+
+
 # ---- Public API ----
-def save_reminder(due_in_minutes: int, text: str, context: TurnContext) -> Tuple[int, datetime]:
+_INSERT_REMINDER_SQL = (
+    "INSERT INTO reminders (due_at_utc, text, conversation_ref, sent) VALUES (?, ?, ?, 0)"
+)
+
+
+async def save_reminder(
+    due_in_minutes: int, text: str, context: TurnContext
+) -> Tuple[int, datetime]:
     """
     Persist a reminder for the current conversation and return (id, due_at_utc).
     """
-    due_at = datetime.now(timezone.utc) + timedelta(minutes=int(due_in_minutes))
+    return (await save_reminders_bulk([(due_in_minutes, text, context)]))[0]
 
-    # Extract conversation reference using Bot Framework helper
-    conv_ref = BfTurnContext.get_conversation_reference(context.activity)
-    conv_ref_json = json.dumps(_conv_ref_to_dict(conv_ref))
 
-    with _connect() as con:
-        cur = con.execute(
-            "INSERT INTO reminders (due_at_utc, text, conversation_ref, sent) VALUES (?, ?, ?, 0)",
-            (due_at.isoformat(), text, conv_ref_json),
-        )
-        con.commit()
-        return cur.lastrowid, due_at
+async def save_reminders_bulk(items: List[Tuple[int, str, TurnContext]]) -> List[Tuple[int, datetime]]:
+    """
+    Persist several (due_in_minutes, text, context) reminders in a single transaction
+    and return their (id, due_at_utc) in the same order.
+    """
+    now = datetime.now(timezone.utc)
+    rows = []
+    for due_in_minutes, text, context in items:
+        due_at = now + timedelta(minutes=int(due_in_minutes))
+        conv_ref_json = _conversation_ref_for(context.activity)
+        rows.append((due_at, int(due_at.timestamp()), text, conv_ref_json))
 
-async def _send_proactive(adapter: CloudAdapter, conv_ref_dict: Dict[str, Any], message: str):
+    # One prepared statement, reused for every row; ids come from lastrowid, which
+    # executemany() does not report per row.
+    db = _db()
+    ids: List[int] = []
+    async with _WRITE_LOCK, _transaction(db):
+        for _, due_ts, text, conv_ref_json in rows:
+            async with db.execute(_INSERT_REMINDER_SQL, (due_ts, text, conv_ref_json)) as cur:
+                ids.append(cur.lastrowid)
+
+    for rid, (_, due_ts, _, _) in zip(ids, rows):
+        _enqueue(due_ts, rid)
+    return [(rid, row[0]) for rid, row in zip(ids, rows)]
+
+
+# ---- Proactive send ----
+ContinueFn = Callable[[ConversationReference, Callable[[TurnContext], Awaitable[None]], str], Awaitable[Any]]
+_CONTINUE: Optional[ContinueFn] = None
+
+
+def _bind_continue(adapter: CloudAdapter) -> ContinueFn:
+    """
+    Resolve once how to call adapter.continue_conversation. The Agents SDK and BotBuilder
+    order (reference, callback, app_id) differently, so bind by parameter name instead.
+    """
+    params = inspect.signature(adapter.continue_conversation).parameters
+    ref_name = cb_name = id_name = None
+    for name in params:
+        if "callback" in name or "logic" in name:
+            cb_name = name
+        elif "app_id" in name or "bot_id" in name:
+            id_name = name
+        elif "reference" in name or "activity" in name:
+            ref_name = name
+    if ref_name and cb_name and id_name:
+        def _continue(ref, callback, app_id):
+            return adapter.continue_conversation(
+                **{ref_name: ref, cb_name: callback, id_name: app_id}
+            )
+        return _continue
+
+    # Fallback: use claims identity API if available
+    claims = getattr(adapter, "create_claims_identity", None)
+    cont_with_claims = getattr(adapter, "continue_conversation_with_claims", None)
+    if callable(claims) and callable(cont_with_claims):
+        def _continue_with_claims(ref, callback, app_id):
+            # (claims_identity, continuation_activity, callback, audience);
+            # audience can be None in local
+            return cont_with_claims(claims(app_id), ref, callback, None)
+        return _continue_with_claims
+
+    raise TypeError(f"Unsupported continue_conversation signature: {list(params)}")
+
+
+async def _send_proactive(conv_ref_dict: Dict[str, Any], message: str):
     async def _callback(tc: TurnContext):
         await tc.send_activity(message)
 
-    ref = _dict_to_conv_ref(conv_ref_dict)
-    app_id = APP_ID or ""
+    await _CONTINUE(_dict_to_conv_ref(conv_ref_dict), _callback, APP_ID or "")
 
-    # Try both common continue_conversation signatures, then a claims-based fallback.
-    try:
-        # Agents SDK variant: (callback, reference, app_id)
-        await adapter.continue_conversation(_callback, ref, app_id)
-        return
-    except Exception:
-        pass
-    try:
-        # BotBuilder-style: (reference, callback, app_id)
-        await adapter.continue_conversation(ref, _callback, app_id)
+
+# ---- In-memory schedule ----
+# Every unsent reminder as parallel (due_at_utc epoch seconds, id) int64 arrays, kept sorted
+# by due time: 16 bytes per reminder. Text and conversation reference stay in SQLite and are
+# only loaded once a reminder is due, so the delivery task never touches the database (or
+# allocates per-reminder objects) while nothing is due.
+_DUE_TS = array("q")
+_DUE_IDS = array("q")
+_WAKEUP: Optional[asyncio.Event] = None
+RETRY_DELAY_S = 10
+
+
+async def _load_pending() -> None:
+    schedule = await fetch_pending_schedule()
+    _DUE_TS[:] = array("q", (ts for ts, _ in schedule))
+    _DUE_IDS[:] = array("q", (rid for _, rid in schedule))
+
+
+def _enqueue(due_ts: int, rid: int) -> None:
+    i = bisect.bisect_right(_DUE_TS, due_ts)
+    _DUE_TS.insert(i, due_ts)
+    _DUE_IDS.insert(i, rid)
+    # Only a new earliest reminder changes how long the delivery task should sleep.
+    if i == 0 and _WAKEUP is not None:
+        _WAKEUP.set()
+
+
+async def _deliver_due() -> None:
+    now_ts = int(time.time())
+    k = bisect.bisect_right(_DUE_TS, now_ts)
+    # Woken early by a new (not yet due) reminder: a single search, no DB work.
+    if k == 0:
         return
-    except Exception:
-        pass
+    due_ids = _DUE_IDS[:k].tolist()
+    del _DUE_TS[:k]
+    del _DUE_IDS[:k]
 
-    # Fallback: use claims identity API if available
     try:
-        claims = getattr(adapter, "create_claims_identity", None)
-        cont_with_claims = getattr(adapter, "continue_conversation_with_claims", None)
-        if callable(claims) and callable(cont_with_claims):
-            identity = claims(app_id)
-            # audience can be None in local
-            await cont_with_claims(identity, ref, None, _callback)
-            return
-    except Exception as e:
-        # re-raise so the scheduler prints the root cause
-        raise e
+        due = await fetch_reminders(due_ids)
+    except Exception:
+        # e.g. "database is locked": keep them scheduled and try again shortly.
+        for rid in due_ids:
+            _enqueue(now_ts + RETRY_DELAY_S, rid)
+        raise
+
+    sent_ids: List[int] = []
+    for r in due:
+        try:
+            await _send_proactive(r.conversation_ref, f"⏰ Reminder: {r.text}")
+            sent_ids.append(r.id)
+        except Exception as e:  # pragma: no cover
+            # For production code, replace prints with a proper logger.
+            print(f"Failed to send reminder {r.id}: {e}")
+            _enqueue(now_ts + RETRY_DELAY_S, r.id)
+    if sent_ids:
+        await mark_sent_bulk(sent_ids)
+
+
+async def _run_reminders() -> None:
+    """
+    Sleep until the earliest pending reminder is due, or until a new earlier one is
+    queued, then deliver whatever is due. Idle time costs nothing: there is no polling.
+    """
+    while True:
+        if not _DUE_TS:
+            await _WAKEUP.wait()
+        else:
+            delay = _DUE_TS[0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(_WAKEUP.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        _WAKEUP.clear()
+        try:
+            await _deliver_due()
+        except Exception as e:  # pragma: no cover
+            print(f"Reminder delivery failed: {e}")
+
+
+async def _run_housekeeping() -> None:
+    """
+    Checkpoint the WAL every few minutes and prune delivered reminders once a day,
+    starting with a prune at startup since the app rarely stays up for a whole day.
+    """
+    last_prune = float("-inf")
+    while True:
+        try:
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL_S:
+                await prune_sent()
+                last_prune = time.monotonic()
+            await checkpoint_wal()
+        except Exception as e:  # pragma: no cover
+            print(f"Reminder housekeeping failed: {e}")
+        await asyncio.sleep(CHECKPOINT_INTERVAL_S)
 
 
 def setup_scheduler(app: Application, agent_app: AgentApplication) -> None:
     """
-    Wire up the AsyncIOScheduler to check for due reminders and send them.
+    Start the reminder delivery and database housekeeping tasks with the app.
     Called from start_server(..., on_startup=setup_scheduler).
     """
-    init_db()
-
-    scheduler = AsyncIOScheduler(
-        timezone="UTC",
-        job_defaults={"coalesce": True, "max_instances": 1},
-    )
-
-    async def tick():
-        now = datetime.now(timezone.utc)
-        due = fetch_due(now)
-        for r in due:
-            try:
-                await _send_proactive(agent_app.adapter, r.conversation_ref, f"⏰ Reminder: {r.text}")
-                mark_sent(r.id)
-            except Exception as e:  # pragma: no cover
-                # For production code, replace prints with a proper logger.
-                print(f"Failed to send reminder {r.id}: {e}")
-
-    # Schedule the coroutine directly (no adapter.loop usage)
-    scheduler.add_job(tick, "interval", seconds=10)
+    global _CONTINUE
+    _CONTINUE = _bind_continue(agent_app.adapter)
 
     async def _on_startup(_):
-        scheduler.start()
+        global _WAKEUP
+        app["db"] = await init_db()
+        await _load_pending()
+        _WAKEUP = asyncio.Event()
+        app["reminders_task"] = asyncio.create_task(_run_reminders())
+        app["housekeeping_task"] = asyncio.create_task(_run_housekeeping())
         print("Reminder scheduler started")
 
     async def _on_cleanup(_):
-        scheduler.shutdown(wait=False)
+        tasks = (app["reminders_task"], app["housekeeping_task"])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await close_db()
 
     app.on_startup.append(_on_startup)
     app.on_cleanup.append(_on_cleanup)